@@ -0,0 +1,60 @@
+"""
+    Timings for branch relaxation on programs built to stress it.
+
+        python benchmarks/relax.py                  ; 50k, 100k, 200k
+        python benchmarks/relax.py 400000
+
+    one_label   every line branches to a single label at the end, like
+                a shared error exit
+    nested      branch i goes to the i-th label from the end, so every
+                span holds all the ones inside it
+    cascade     branches that just reach, the last one is out of range
+                and each growth pushes out the one before it
+
+    Run with RV32I_PROFILE=1 to see how much of it is the relax stage.
+
+"""
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from rv32i.RV32I_Assembler import assemble_RV32I
+
+
+def oneLabel(n):
+    return ["BEQ x1, x2, end"] * n + ["end: ADDI x1, x1, 1"]
+
+
+def nested(n):
+    return ([f"BEQ x1, x2, L{i}" for i in range(n)] +
+            [f"L{i}: ADDI x1, x1, 1" for i in reversed(range(n))])
+
+
+def cascade(n, gap=1000):
+    lines = ["NOP"] * n
+    for i in range(0, n - 1100, gap):
+        lines[i] = "BEQ x1, x2, 4092"
+    lines[i] = "BEQ x1, x2, 4096"
+    return lines
+
+
+SHAPES = {"one_label" : oneLabel,
+          "nested" : nested,
+          "cascade" : cascade}
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [50000, 100000, 200000]
+    sys.stdout.write(f"{'shape':<12}{'lines':>10}{'words':>10}{'seconds':>10}\n")
+    for name, shape in SHAPES.items():
+        for n in sizes:
+            lines = shape(n)
+            start = perf_counter()
+            program = assemble_RV32I(lines)
+            elapsed = perf_counter() - start
+            sys.stdout.write(f"{name:<12}{len(lines):>10}{len(program):>10}{elapsed:>10.2f}\n")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
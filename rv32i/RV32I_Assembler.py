@@ -0,0 +1,520 @@
+"""
+    Program level assembler for the RV32I Single Cycle CPU.
+
+    parseAssembly_RV32I handles one line at a time, this handles a
+    whole program so that branch and jump targets can be checked
+    against the final layout. Targets may be labels ("loop:") or
+    the usual byte offsets relative to the instruction.
+
+    Branches and JALs whose target is out of reach are relaxed:
+
+        BEQ  far    ->  BNE  +8     ; inverted branch over a JAL
+                        JAL  x0, far
+
+        BEQ  far    ->  BNE  +12    ; past +-1MiB
+                        AUIPC t1, %hi(far)
+                        JALR  x0, %lo(far)(t1)
+
+        JAL  rd, far -> AUIPC rd, %hi(far)  ; t1 when rd is x0
+                        JALR  rd, %lo(far)(rd)
+
+    The far forms of branches and of JALs that do not link need a
+    scratch register, t1 unless scratchReg says otherwise. Assembly
+    fails when the program uses that register itself.
+
+    The pseudo-instructions J, CALL, BEQZ and BNEZ are relaxed the same
+    way. LI and LA take the shortest form that holds the value, a lone
+    ADDI when it fits in 12 bits.
+
+    With optimize=True instructions that have no effect (NOPs, moves
+    of a register onto itself, writes to x0) are dropped. Labels and
+    offsets pointing at them land on the next instruction instead.
+
+"""
+import re
+from bisect import bisect_left
+from heapq import heappush, heappop
+from itertools import accumulate
+
+from rv32i.RV32I_Instr import *
+from rv32i.RV32I_Instr import __parse_RV32I_assembly_raw
+from rv32i.RV32I_Profile import instrumented, linesSize
+
+# Scratch register for far jumps that do not link, same as GNU "tail"
+RELAX_SCRATCH_REG = 6
+
+BRANCH_INVERSE = {"BEQ" : "BNE",  "BNE" : "BEQ",
+                  "BLT" : "BGE",  "BGE" : "BLT",
+                  "BLTU": "BGEU", "BGEU": "BLTU"}
+
+BRANCH_CLASS = {"BEQ" : BEQ,  "BNE" : BNE,
+                "BLT" : BLT,  "BGE" : BGE,
+                "BLTU": BLTU, "BGEU": BGEU}
+
+# Relaxable site kinds and the size in words of each of their forms
+SITE_BRANCH = 0
+SITE_JAL = 1
+SITE_LA = 2
+SITE_SIZES = {SITE_BRANCH : (1, 2, 3),
+              SITE_JAL    : (1, 2),
+              SITE_LA     : (1, 2)}
+
+# What the one word form can reach. For LA this is an absolute
+# address (ADDI from x0), the others are relative to the site.
+SITE_SHORT_RANGE = {SITE_BRANCH : (B_IMM_MIN, B_IMM_MAX),
+                    SITE_JAL    : (J_IMM_MIN, J_IMM_MAX),
+                    SITE_LA     : (I_IMM_MIN, I_IMM_MAX)}
+
+# Pseudo-instructions that become a relax site: (kind, mnemonic, rd)
+PSEUDO_SITES = {"J"    : (SITE_JAL, "JAL", 0),
+                "CALL" : (SITE_JAL, "JAL", 1),
+                "BEQZ" : (SITE_BRANCH, "BEQ", 0),
+                "BNEZ" : (SITE_BRANCH, "BNE", 0)}
+
+# Slack of a site already at its largest form
+INFINITE_SLACK = float("inf")
+
+# Full passes over the sites before falling back to the worklist
+RELAX_PASSES = 4
+
+OPCODE_OP_IMM = "0010011"
+OPCODE_OP = "0110011"
+OPCODE_LUI = "0110111"
+OPCODE_AUIPC = "0010111"
+
+LABEL_RE = re.compile(r'^\s*([A-Za-z_.$][\w.$]*)\s*:')
+
+
+class relaxSite:
+    """A branch, jump or LA whose encoding depends on the final layout"""
+    __slots__ = ("index", "kind", "mnemonic", "rd", "rs1", "rs2",
+                 "target", "external", "form", "line")
+
+    def __init__(self, index, kind, mnemonic, rd, rs1, rs2, line):
+        self.index = index          # Position in the item list
+        self.kind = kind
+        self.mnemonic = mnemonic
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.target = None          # Item index, or absolute address if external
+        self.external = False
+        self.form = 0
+        self.line = line
+
+    def span(self):
+        """Items whose growth moves this site's target relative to it,
+        as a half open range [lo, hi)"""
+        if self.external:
+            return 0, self.index
+        if self.kind == SITE_LA:
+            return 0, self.target
+        if self.target > self.index:
+            return self.index, self.target
+        return self.target, self.index
+
+
+class sizeTree:
+    """Fenwick tree over item sizes, so addresses stay cheap to look
+    up while sites grow one at a time"""
+    def __init__(self, sizes):
+        self.n = len(sizes)
+        self.tree = [0] + list(sizes)
+        for i in range(1, self.n + 1):
+            j = i + (i & -i)
+            if j <= self.n:
+                self.tree[j] += self.tree[i]
+
+    def add(self, index, delta):
+        i = index + 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def addr(self, index):
+        """Byte address of item index"""
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return 4 * total
+
+
+def assemble_RV32I(lines, upperCase=False, optimize=False, scratchReg=RELAX_SCRATCH_REG):
+    """Assemble a program, relaxing out of range branches and jumps.
+    Returns the list of instruction objects in memory order."""
+    if not 1 <= scratchReg <= 31:
+        raise ValueError(f"Scratch register x{scratchReg} can not hold an address.")
+    lines = list(lines)
+    items, sites, labels, targets = __parse_program(lines)
+    __resolve_targets(items, sites, labels, targets)
+
+    if optimize:
+        for i, item in enumerate(items):
+            if item is not None:
+                items[i] = [instr for instr in item if not __is_redundant(instr)]
+
+    sizes = [len(item) if item is not None else 1 for item in items]
+    addr = __relax(sizes, sites)
+    __check_scratch(items, sites, scratchReg)
+
+    # Emit relaxed sites in place of their placeholders
+    emitted = {site.index : __emit_site(site, addr, scratchReg) for site in sites}
+    program = []
+    for i, item in enumerate(items):
+        if item is None:
+            program.extend(emitted[i])
+        else:
+            program.extend(item)
+
+    for instr in program:
+        instr.upperCase = upperCase
+    return program
+
+
+@instrumented("parse_program", linesSize)
+def __parse_program(lines):
+    items = []          # list of instruction objects, None for a relax site
+    sites = []
+    labels = {}
+    targets = []        # Raw target operand of each site
+
+    for lineNum, line in enumerate(lines, 1):
+        line = line.split(';', 1)[0]
+
+        match = LABEL_RE.match(line)
+        while match:
+            if match.group(1) in labels:
+                raise ValueError(f"Line {lineNum}: label {match.group(1)} is defined twice.")
+            labels[match.group(1)] = len(items)
+            line = line[match.end():]
+            match = LABEL_RE.match(line)
+
+        line = line.strip()
+        if not line:
+            continue
+
+        tokens = re.split(r'[,\s]+', re.sub(r'[\(\)\n]+', ' ', line))
+        mnemonic = tokens[0].upper()
+
+        if mnemonic in BRANCH_CLASS:
+            site = relaxSite(len(items), SITE_BRANCH, mnemonic, 0,
+                             int(tokens[2][1:]), int(tokens[1][1:]), lineNum)
+            target = tokens[3]
+        elif mnemonic == "JAL":
+            site = relaxSite(len(items), SITE_JAL, mnemonic,
+                             int(tokens[1][1:]), 0, 0, lineNum)
+            target = tokens[2]
+        elif mnemonic in ("J", "CALL"):
+            kind, base, rd = PSEUDO_SITES[mnemonic]
+            site = relaxSite(len(items), kind, base, rd, 0, 0, lineNum)
+            target = tokens[1]
+        elif mnemonic in ("BEQZ", "BNEZ"):
+            kind, base, rd = PSEUDO_SITES[mnemonic]
+            site = relaxSite(len(items), kind, base, rd,
+                             0, int(tokens[1][1:]), lineNum)
+            target = tokens[2]
+        elif mnemonic == "LI" or (mnemonic == "LA" and __is_number(tokens[2])):
+            items.append(expandLI_RV32I(int(tokens[1][1:]), int(tokens[2], 0)))
+            continue
+        elif mnemonic == "LA":
+            site = relaxSite(len(items), SITE_LA, mnemonic,
+                             int(tokens[1][1:]), 0, 0, lineNum)
+            target = tokens[2]
+        else:
+            instr = __parse_RV32I_assembly_raw(line)
+            if instr is None:
+                raise ValueError(f"Line {lineNum}: unknown instruction \"{line}\".")
+            items.append([instr])
+            continue
+
+        sites.append(site)
+        targets.append(target)
+        items.append(None)
+
+    return items, sites, labels, targets
+
+
+def __is_number(token):
+    try:
+        int(token, 0)
+    except ValueError:
+        return False
+    return True
+
+
+def __is_redundant(instr):
+    """True for instructions that leave every register unchanged"""
+    rd = int(instr.rd, 2) if hasattr(instr, "rd") else None
+    if instr.opcode in (OPCODE_LUI, OPCODE_AUIPC):
+        return rd == 0
+
+    if instr.opcode == OPCODE_OP_IMM:
+        rs1 = int(instr.rs1, 2)
+        match instr.funct3:
+            case "000" | "100" | "110":     # ADDI, XORI, ORI rd, rd, 0
+                return rd == 0 or (rd == rs1 and int(instr.imm, 2) == 0)
+            case "001" | "101":             # SLLI, SRLI, SRAI rd, rd, 0
+                return rd == 0 or (rd == rs1 and int(instr.rs2, 2) == 0)
+            case "111":                     # ANDI rd, rd, -1
+                return rd == 0 or (rd == rs1 and instr.imm == "1" * 12)
+        return rd == 0
+
+    if instr.opcode == OPCODE_OP:
+        rs1 = int(instr.rs1, 2)
+        rs2 = int(instr.rs2, 2)
+        match instr.funct3:
+            case "000" | "001" | "101":     # ADD, SUB, SLL, SRL, SRA rd, rd, x0
+                if rd == rs1 and rs2 == 0:
+                    return True
+                if instr.funct7 == "0000000" and instr.funct3 == "000":
+                    return rd == 0 or (rd == rs2 and rs1 == 0)
+            case "100" | "110":             # XOR, OR with x0 on either side
+                if (rd == rs1 and rs2 == 0) or (rd == rs2 and rs1 == 0):
+                    return True
+                if instr.funct3 == "110" and rd == rs1 == rs2:
+                    return True
+            case "111":                     # AND rd, rd, rd
+                if rd == rs1 == rs2:
+                    return True
+        return rd == 0
+
+    return False
+
+
+def __resolve_targets(items, sites, labels, targets):
+    # Numeric offsets are written against the unrelaxed layout where every
+    # line is one word. Those landing inside the program follow the line
+    # they point at, anything else is taken as a fixed address.
+    end = len(items)
+    for site, target in zip(sites, targets):
+        if target in labels:
+            site.target = labels[target]
+            continue
+
+        try:
+            offset = int(target, 0)
+        except ValueError:
+            raise ValueError(f"Line {site.line}: undefined label {target}.") from None
+
+        index = site.index + offset // 4
+        if offset % 4 == 0 and 0 <= index <= end:
+            site.target = index
+        else:
+            site.target = site.index * 4 + offset
+            site.external = True
+
+
+def __site_slack(site, addrOf):
+    """Bytes the span of a site can still grow by before its current
+    form stops reaching the target, negative when it already does not"""
+    pc = 0 if site.kind == SITE_LA else addrOf(site.index)
+    dest = site.target if site.external else addrOf(site.target)
+
+    if site.form == 0:
+        low, high = SITE_SHORT_RANGE[site.kind]
+    elif site.kind == SITE_BRANCH and site.form == 1:
+        low, high = J_IMM_MIN, J_IMM_MAX
+        pc += 4
+    else:
+        return INFINITE_SLACK
+
+    offset = dest - pc
+    if not low <= offset <= high:
+        return -1
+    # Growth in the span pushes a forward target up and pulls the site
+    # away from a backward or fixed one
+    if site.external or (site.kind != SITE_LA and site.target <= site.index):
+        return offset - low
+    return high - offset
+
+
+@instrumented("relax")
+def __relax(sizes, sites):
+    """Grow sites until every one reaches its target. Returns the
+    byte address of every item (plus the end of the program)."""
+    # Sizes only ever grow, so a site that fits when everything around
+    # it is at its largest form never needs to be looked at again. That
+    # leaves only the long branches on the worklist.
+    maxSizes = list(sizes)
+    for site in sites:
+        maxSizes[site.index] = SITE_SIZES[site.kind][-1]
+    maxAddr = [4 * words for words in accumulate(maxSizes, initial=0)]
+    minAddr = [4 * words for words in accumulate(sizes, initial=0)]
+
+    worklist = []
+    for site in sites:
+        if site.external:
+            # Only the site itself moves, check both ends of where it can land
+            if __site_slack(site, minAddr.__getitem__) >= 0 and __site_slack(site, maxAddr.__getitem__) >= 0:
+                continue
+        else:
+            low, high = SITE_SHORT_RANGE[site.kind]
+            origin = 0 if site.kind == SITE_LA else maxAddr[site.index]
+            if low <= maxAddr[site.target] - origin <= high:
+                continue
+        worklist.append(site)
+
+    # A few plain passes settle most programs. Addresses lag one pass
+    # behind, which is safe as they only ever grow.
+    for _ in range(RELAX_PASSES):
+        addr = [4 * words for words in accumulate(sizes, initial=0)]
+        grew = False
+        for site in worklist:
+            if site.form < len(SITE_SIZES[site.kind]) - 1 and __site_slack(site, addr.__getitem__) < 0:
+                site.form += 1
+                sizes[site.index] = SITE_SIZES[site.kind][site.form]
+                grew = True
+        if not grew:
+            return addr
+
+    # Long cascades, where each growth pushes out one more site, are
+    # left to a worklist that only wakes a site once its span has grown
+    # by more than its slack
+    # Only worklist sites ever grow, so spans are kept as ranges of
+    # worklist positions. Each range sits on O(log n) nodes of a segment
+    # tree that count the words grown below them.
+    positions = [site.index for site in worklist]
+    lows = []
+    highs = []
+    for site in worklist:
+        lo, hi = site.span()
+        lows.append(bisect_left(positions, lo))
+        highs.append(bisect_left(positions, hi))
+
+    leaves = 1
+    while leaves < len(worklist):
+        leaves <<= 1
+    grown = [0] * (2 * leaves)
+    watches = {}                # Node -> heap of (grown trigger, stamp, site)
+    stamp = [0] * len(worklist) # Stamp of a site's live watches, 0 for none
+    lastForm = [len(SITE_SIZES[site.kind]) - 1 for site in worklist]
+    serial = 0
+
+    tree = sizeTree(sizes)
+    batch = [k for k in range(len(worklist)) if worklist[k].form < lastForm[k]]
+    while batch:
+        # Check the woken sites, growing the ones out of reach
+        growth = {}
+        woken = []
+        for k in batch:
+            site = worklist[k]
+            slack = __site_slack(site, tree.addr)
+
+            if slack >= 0:
+                # Split the slack over the span's nodes. Until one of them
+                # grows past its share the whole span can not have grown
+                # past the slack, so the site is left alone until then.
+                nodes = []
+                lo = lows[k] + leaves
+                hi = highs[k] + leaves
+                while lo < hi:
+                    if lo & 1:
+                        nodes.append(lo)
+                        lo += 1
+                    if hi & 1:
+                        hi -= 1
+                        nodes.append(hi)
+                    lo >>= 1
+                    hi >>= 1
+                if nodes:
+                    serial += 1
+                    stamp[k] = serial
+                    share = slack // 4 // len(nodes) + 1
+                    for node in nodes:
+                        heappush(watches.setdefault(node, []), (grown[node] + share, serial, k))
+                continue
+
+            site.form += 1
+            size = SITE_SIZES[site.kind][site.form]
+            growth[k + leaves] = size - sizes[site.index]
+            tree.add(site.index, size - sizes[site.index])
+            sizes[site.index] = size
+            if site.form < lastForm[k]:
+                woken.append(k)
+
+        # Carry the growth up a level at a time so a node shared by many
+        # grown sites is only visited once, waking the sites whose share
+        # it used up
+        while growth:
+            up = {}
+            for node, delta in growth.items():
+                grown[node] += delta
+                heap = watches.get(node)
+                while heap and heap[0][0] <= grown[node]:
+                    _, live, k = heappop(heap)
+                    if live == stamp[k]:
+                        stamp[k] = 0
+                        woken.append(k)
+                if node > 1:
+                    up[node >> 1] = up.get(node >> 1, 0) + delta
+            growth = up
+        batch = woken
+
+    return [4 * words for words in accumulate(sizes, initial=0)]
+
+
+def __uses_register(instr, reg):
+    reg = "{:05b}".format(reg)
+    if getattr(instr, "rd", None) == reg or getattr(instr, "rs1", None) == reg:
+        return True
+    # The shift immediates keep their shamt in rs2
+    return not isinstance(instr, R_type_shift) and getattr(instr, "rs2", None) == reg
+
+
+def __check_scratch(items, sites, scratchReg):
+    """Refuse to clobber a scratch register the program relies on"""
+    far = [site for site in sites
+           if (site.kind == SITE_BRANCH and site.form == 2) or
+              (site.kind == SITE_JAL and site.form == 1 and site.rd == 0)]
+    if not far:
+        return
+
+    used = any(scratchReg in (site.rd, site.rs1, site.rs2) for site in sites) or \
+           any(__uses_register(instr, scratchReg) for item in items if item is not None for instr in item)
+    if used:
+        raise ValueError(f"Line {far[0].line}: the far jump needs x{scratchReg} as scratch but the "
+                         f"program uses it, pick a free scratch register.")
+
+
+def __hi_lo(offset):
+    """Split an offset into an AUIPC/LUI upper part and a signed 12 bit
+    lower part, carrying into the upper part when the lower is negative"""
+    lo = ((offset & 0xFFF) ^ 0x800) - 0x800
+    hi = (offset - lo) & 0xFFFFFFFF
+    return hi, lo & 0xFFF
+
+
+def __emit_site(site, addr, scratchReg):
+    pc = addr[site.index]
+    dest = site.target if site.external else addr[site.target]
+
+    if site.kind == SITE_BRANCH:
+        if site.form == 0:
+            return [BRANCH_CLASS[site.mnemonic](site.rs2, site.rs1, (dest - pc) & 0x1FFF)]
+
+        inverse = BRANCH_CLASS[BRANCH_INVERSE[site.mnemonic]]
+        if site.form == 1:
+            return [inverse(site.rs2, site.rs1, 8),
+                    JAL(0, (dest - (pc + 4)) & 0x1FFFFF)]
+
+        hi, lo = __hi_lo(dest - (pc + 4))
+        return [inverse(site.rs2, site.rs1, 12),
+                AUIPC(scratchReg, hi),
+                JALR(scratchReg, 0, lo)]
+
+    if site.kind == SITE_LA:
+        if site.form == 0:
+            return [ADDI(0, site.rd, dest & 0xFFF)]
+
+        hi, lo = __hi_lo(dest - pc)
+        return [AUIPC(site.rd, hi),
+                ADDI(site.rd, site.rd, lo)]
+
+    if site.form == 0:
+        return [JAL(site.rd, (dest - pc) & 0x1FFFFF)]
+
+    scratch = site.rd if site.rd != 0 else scratchReg
+    hi, lo = __hi_lo(dest - pc)
+    return [AUIPC(scratch, hi),
+            JALR(scratch, site.rd, lo)]
@@ -0,0 +1,426 @@
+"""
+    Control flow graph and static cycle estimate for RV32I programs.
+
+    Splits a program into basic blocks at branches, JAL and JALR,
+    finds the natural loops and bounds how many cycles a run can
+    take on the single cycle CPU, where every instruction is one
+    cycle. Nothing is executed.
+
+    JAL with a link register is taken as a call, the block continues
+    at the return address and the callee's worst case is charged to
+    the calling block. JALR ends a function (return or indirect jump),
+    unless its base register was just set by an AUIPC. That is how the
+    assembler writes far jumps and calls, and the pair is taken as a
+    JAL to the address it computes.
+    A JAL to itself is how the CPU halts and ends the program, whatever
+    its link register.
+
+    Loops need an iteration bound to be counted, given by the address
+    of their header. Without one the worst case is unbounded (None).
+
+"""
+from bisect import bisect_right
+
+from rv32i.RV32I_Words import sext, immI, immB, immJ, toWords_RV32I
+
+OPCODE_BRANCH = 0x63
+OPCODE_JAL = 0x6F
+OPCODE_JALR = 0x67
+OPCODE_AUIPC = 0x17
+
+TERM_FALL = "fall"          # Runs into the next block
+TERM_BRANCH = "branch"
+TERM_JUMP = "jump"          # JAL x0
+TERM_CALL = "call"          # JAL with a link register
+TERM_JALR = "jalr"
+TERM_HALT = "halt"          # JAL to itself
+
+INFINITE = float("inf")
+
+
+class basicBlock:
+    __slots__ = ("id", "start", "end", "terminator", "succs", "preds", "calls")
+
+    def __init__(self, id, start, end, terminator):
+        self.id = id
+        self.start = start          # Byte address of the first instruction
+        self.end = end              # Byte address just past the last one
+        self.terminator = terminator
+        self.succs = []             # Block ids
+        self.preds = []
+        self.calls = []             # Block ids of called functions
+
+    def count(self):
+        return (self.end - self.start) // 4
+
+    def __repr__(self):
+        return f"basicBlock({self.id}, {self.start:#x}-{self.end:#x}, {self.terminator})"
+
+
+class naturalLoop:
+    __slots__ = ("header", "latches", "body")
+
+    def __init__(self, header):
+        self.header = header        # Block id
+        self.latches = []           # Blocks with a back edge to the header
+        self.body = set()           # Block ids, header included
+
+
+class controlFlowGraph:
+    def __init__(self, words, base=0):
+        self.base = base
+        self.size = len(words)
+        self.blocks = []
+        self.starts = []            # Sorted block start addresses, for blockAt
+        self.functions = []         # Entry block ids, the program entry first
+        self.loops = []
+
+        self.__build(words)
+        if self.blocks:
+            self.__find_loops()
+
+    def blockAt(self, addr):
+        """Block holding the instruction at addr, or None"""
+        if not (self.base <= addr < self.base + 4 * self.size):
+            return None
+        return self.blocks[bisect_right(self.starts, addr) - 1]
+
+    def __build(self, words):
+        n = len(words)
+        base = self.base
+        leaders = {0}
+        control = {}                # Word index -> (terminator, target index, rd)
+        farJumps = {}               # JALR index -> offset from its AUIPC
+
+        for i, w in enumerate(words):
+            op = w & 0x7F
+            if op == OPCODE_BRANCH:
+                imm = immB(w)
+                kind = TERM_BRANCH
+            elif op == OPCODE_JAL:
+                imm = immJ(w)
+                kind = TERM_CALL if (w >> 7) & 0x1F else TERM_JUMP
+            elif op == OPCODE_JALR:
+                control[i] = (TERM_JALR, None, (w >> 7) & 0x1F)
+                leaders.add(i + 1)
+                prev = words[i - 1] if i else 0
+                if prev & 0x7F == OPCODE_AUIPC and (prev >> 7) & 0x1F and (prev >> 7) & 0x1F == (w >> 15) & 0x1F:
+                    farJumps[i] = (sext(prev & 0xFFFFF000, 32) + immI(w)) & ~1
+                continue
+            else:
+                continue
+
+            # Targets off the image or between words are left dangling
+            target = i + imm // 4
+            if imm % 4 or not (0 <= target < n):
+                target = None
+            else:
+                leaders.add(target)
+            if op == OPCODE_JAL and target == i:
+                kind = TERM_HALT
+            control[i] = (kind, target, (w >> 7) & 0x1F)
+            leaders.add(i + 1)
+
+        # An AUIPC/JALR pair is only a far JAL when nothing jumps straight
+        # to the JALR, which would skip setting its base register
+        while True:
+            targets = {i - 1 + offset // 4 for i, offset in farJumps.items()}
+            stale = [i for i in farJumps if i in leaders or i in targets]
+            if not stale:
+                break
+            for i in stale:
+                del farJumps[i]
+        for i, offset in farJumps.items():
+            rd = control[i][2]
+            target = i - 1 + offset // 4
+            if offset % 4 or not (0 <= target < n):
+                target = None
+            else:
+                leaders.add(target)
+            control[i] = (TERM_CALL if rd else TERM_JUMP, target, rd)
+
+        leaders.discard(n)
+        leaders = sorted(leaders) if n else []
+        blockOf = {}
+        for k, start in enumerate(leaders):
+            stop = leaders[k + 1] if k + 1 < len(leaders) else n
+            kind = control.get(stop - 1, (TERM_FALL,))[0]
+            self.blocks.append(basicBlock(k, base + 4 * start, base + 4 * stop, kind))
+            self.starts.append(base + 4 * start)
+            blockOf[start] = k
+
+        calls = set()
+        for k, start in enumerate(leaders):
+            block = self.blocks[k]
+            stop = leaders[k + 1] if k + 1 < len(leaders) else n
+            _, target, _ = control.get(stop - 1, (TERM_FALL, None, 0))
+            next = k + 1 if stop < n else None
+
+            if block.terminator == TERM_FALL:
+                succs = [next]
+            elif block.terminator == TERM_BRANCH:
+                succs = [blockOf.get(target), next]
+            elif block.terminator == TERM_JUMP:
+                succs = [blockOf.get(target)]
+            elif block.terminator == TERM_CALL:
+                succs = [next]
+                if target is not None:
+                    block.calls.append(blockOf[target])
+                    calls.add(blockOf[target])
+            else:
+                succs = []
+
+            for s in succs:
+                if s is not None and s not in block.succs:
+                    block.succs.append(s)
+                    self.blocks[s].preds.append(k)
+
+        if self.blocks:
+            self.functions = [0] + sorted(calls - {0})
+
+    def __find_loops(self):
+        blocks = self.blocks
+        nb = len(blocks)
+        root = nb                   # Virtual root in front of every function
+
+        def succsOf(b):
+            return self.functions if b == root else blocks[b].succs
+
+        # Reverse postorder from the root
+        order = []
+        seen = [False] * (nb + 1)
+        seen[root] = True
+        stack = [(root, iter(succsOf(root)))]
+        while stack:
+            node, it = stack[-1]
+            for s in it:
+                if not seen[s]:
+                    seen[s] = True
+                    stack.append((s, iter(succsOf(s))))
+                    break
+            else:
+                order.append(node)
+                stack.pop()
+        order.reverse()
+        rpo = [0] * (nb + 1)
+        for i, b in enumerate(order):
+            rpo[b] = i
+
+        # Cooper, Harvey and Kennedy's iterative dominator algorithm
+        idom = [None] * (nb + 1)
+        idom[root] = root
+        entries = set(self.functions)
+        changed = True
+        while changed:
+            changed = False
+            for b in order[1:]:
+                preds = blocks[b].preds
+                if b in entries:
+                    preds = preds + [root]
+                new = None
+                for p in preds:
+                    if idom[p] is None:
+                        continue
+                    if new is None:
+                        new = p
+                        continue
+                    a = p
+                    while a != new:
+                        while rpo[a] > rpo[new]:
+                            a = idom[a]
+                        while rpo[new] > rpo[a]:
+                            new = idom[new]
+                if idom[b] != new:
+                    idom[b] = new
+                    changed = True
+
+        # Number the dominator tree so dominance is an interval test
+        children = [[] for _ in range(nb + 1)]
+        for b in order[1:]:
+            children[idom[b]].append(b)
+        tin = [0] * (nb + 1)
+        tout = [0] * (nb + 1)
+        clock = 0
+        stack = [(root, iter(children[root]))]
+        while stack:
+            node, it = stack[-1]
+            for c in it:
+                clock += 1
+                tin[c] = clock
+                stack.append((c, iter(children[c])))
+                break
+            else:
+                clock += 1
+                tout[node] = clock
+                stack.pop()
+
+        # A back edge goes to a block that dominates its source
+        loops = {}
+        for b in order[1:]:
+            for s in blocks[b].succs:
+                if tin[s] <= tin[b] and tout[b] <= tout[s]:
+                    loop = loops.get(s)
+                    if loop is None:
+                        loop = loops[s] = naturalLoop(s)
+                        loop.body.add(s)
+                    loop.latches.append(b)
+                    stack = [b]
+                    while stack:
+                        node = stack.pop()
+                        if node not in loop.body:
+                            loop.body.add(node)
+                            # Dead code running into the loop is not part of it
+                            stack.extend(p for p in blocks[node].preds if idom[p] is not None)
+
+        self.loops = sorted(loops.values(), key=lambda loop: blocks[loop.header].start)
+
+    def worstCaseCycles(self, loopBounds=None):
+        """Upper bound on the cycles from the program entry to a JALR or
+        the end of the image. loopBounds maps loop header addresses to
+        the most times the loop body runs. None when unbounded."""
+        if not self.blocks:
+            return 0
+
+        cost = self.__function_costs(loopBounds or {})[0]
+        return None if cost == INFINITE else cost
+
+    def __function_costs(self, loopBounds):
+        blocks = self.blocks
+        rep = list(range(len(blocks)))
+
+        def find(b):
+            root = b
+            while rep[root] != root:
+                root = rep[root]
+            while rep[b] != root:
+                rep[b], b = root, rep[b]
+            return root
+
+        # Collapse every loop into its header, innermost first. Natural
+        # loops with different headers are nested or disjoint, so body
+        # size gives that order. Each loop keeps the edges between the
+        # nodes it holds, back edges to its header left out.
+        inner = {}                  # Header -> {node: succ nodes} inside its loop
+        for loop in sorted(self.loops, key=lambda loop: len(loop.body)):
+            h = loop.header
+            edges = {}
+            for b in loop.body:
+                node = find(b)
+                succs = edges.setdefault(node, set())
+                for s in blocks[b].succs:
+                    if s in loop.body:
+                        s = find(s)
+                        if s != node and s != h:
+                            succs.add(s)
+            for node in edges:
+                if node != h:
+                    rep[node] = h
+            inner[h] = edges
+
+        top = {}                    # Node -> succ nodes, outside every loop
+        for b, block in enumerate(blocks):
+            node = find(b)
+            succs = top.setdefault(node, set())
+            for s in block.succs:
+                s = find(s)
+                if s != node:
+                    succs.add(s)
+
+        # Every cost is a longest path or a sum over others, worked out
+        # once each in a single pass, callees and inner loops first
+        TOP, INNER, LOOP, BLOCK = range(4)
+
+        def costOf(node):
+            return (LOOP, node, None) if node in inner else (BLOCK, node, None)
+
+        def depsOf(task):
+            kind, node, h = task
+            if kind == TOP:
+                return [costOf(node)] + [(TOP, s, None) for s in top[node]]
+            if kind == INNER:
+                own = (BLOCK, h, None) if node == h else costOf(node)
+                return [own] + [(INNER, s, h) for s in inner[h][node]]
+            if kind == LOOP:
+                if loopBounds.get(blocks[node].start) is None:
+                    return []
+                return [(INNER, node, node), (BLOCK, node, None)]
+            return [(TOP, find(c), None) for c in blocks[node].calls]
+
+        def evaluate(task, deps):
+            kind, node, _ = task
+            if kind == LOOP:
+                bound = loopBounds.get(blocks[node].start)
+                if bound is None:
+                    return INFINITE
+                return bound * value[deps[0]] + value[deps[1]]
+            if kind == BLOCK:
+                return blocks[node].count() + sum(value[d] for d in deps)
+            return value[deps[0]] + max((value[d] for d in deps[1:]), default=0)
+
+        value = {}
+        for f in self.functions:
+            task = (TOP, find(f), None)
+            if task in value:
+                continue
+            # A task met again while still open is a cycle: recursion or a
+            # loop that is not natural, neither can be bounded
+            active = {task}
+            cyclic = set()
+            stack = [(task, depsOf(task), 0)]
+            while stack:
+                task, deps, i = stack[-1]
+                while i < len(deps) and deps[i] in value:
+                    i += 1
+                if i < len(deps):
+                    stack[-1] = (task, deps, i + 1)
+                    dep = deps[i]
+                    if dep in active:
+                        cyclic.add(task)
+                    else:
+                        active.add(dep)
+                        stack.append((dep, depsOf(dep), 0))
+                    continue
+                stack.pop()
+                active.discard(task)
+                value[task] = INFINITE if task in cyclic else evaluate(task, deps)
+
+        return [value[(TOP, find(f), None)] for f in self.functions]
+
+    def report(self, loopBounds=None):
+        """Summary of the program as a dict"""
+        reachable = set()
+        stack = list(self.functions)
+        while stack:
+            b = stack.pop()
+            if b not in reachable:
+                reachable.add(b)
+                stack.extend(self.blocks[b].succs)
+
+        return {
+            "instructions" : self.size,
+            "reachable_instructions" : sum(self.blocks[b].count() for b in reachable),
+            "blocks" : len(self.blocks),
+            "functions" : [self.blocks[f].start for f in self.functions],
+            "loops" : [{"header" : self.blocks[loop.header].start,
+                        "blocks" : len(loop.body),
+                        "instructions" : sum(self.blocks[b].count() for b in loop.body)}
+                       for loop in self.loops],
+            "worst_case_cycles" : self.worstCaseCycles(loopBounds),
+        }
+
+
+def buildCFG_RV32I(program, base=0):
+    """Build the CFG of a program given as instruction objects (from
+    parseHex_RV32I or assemble_RV32I), hex strings or integer words"""
+    return controlFlowGraph(toWords_RV32I(program), base)
+
+
+def loadImage_RV32I(path):
+    """Read a hex image, one 32 bit word per line"""
+    words = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split(';', 1)[0].strip()
+            if line:
+                words.append(int(line, 16))
+    return words
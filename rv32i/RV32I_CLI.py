@@ -0,0 +1,211 @@
+"""
+    Command line front end, installed as "rv32i".
+
+        rv32i assemble Test.rv32i -o Test.hex
+        rv32i disassemble Test.hex
+        rv32i simulate Test.rv32i
+        rv32i daemon &
+
+    Only the standard library is imported at startup, the instruction
+    tables are pulled in when a command needs them. When a daemon is
+    listening (rv32i daemon) assemble and disassemble are sent to it
+    instead, which skips those imports altogether.
+
+"""
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+
+# Seconds to wait on the daemon before doing the work in process
+DAEMON_TIMEOUT = 120
+
+# Opcodes parseHex_RV32I decodes, it prints to stdout for any other
+KNOWN_OPCODES = {0x37, 0x17, 0x6F, 0x67, 0x63, 0x03, 0x23, 0x13, 0x33}
+
+
+def defaultSocketPath():
+    if "RV32I_SOCKET" in os.environ:
+        return os.environ["RV32I_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "rv32i.sock")
+    return f"/tmp/rv32i-{os.getuid()}.sock"
+
+
+def daemonRequest(path, message, timeout=DAEMON_TIMEOUT):
+    """Send one request to a running daemon. Returns the decoded
+    response, or None when no daemon of ours answers on path."""
+    try:
+        # Anyone can create a file in /tmp, only talk to our own socket
+        info = os.lstat(path)
+        if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+            return None
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(json.dumps(message).encode() + b"\n")
+            with sock.makefile("rb") as file:
+                line = file.readline()
+        return json.loads(line) if line else None
+    except (OSError, ValueError):
+        # Missing, refused, reset, timed out or a garbled reply
+        return None
+
+
+def handleRequest(request):
+    """Answer one request, for both the daemon and the local path"""
+    match request.get("op"):
+        case "assemble":
+            from rv32i.RV32I_Assembler import assemble_RV32I, RELAX_SCRATCH_REG
+
+            program = assemble_RV32I(request["lines"],
+                                     upperCase=request.get("upperCase", False),
+                                     optimize=request.get("optimize", False),
+                                     scratchReg=request.get("scratchReg", RELAX_SCRATCH_REG))
+            return {"ok" : True, "hex" : [instr.gethex() for instr in program]}
+        case "disassemble":
+            from rv32i.RV32I_Instr import parseHex_RV32I
+
+            assembly = []
+            for word in request["hex"]:
+                if len(word.removeprefix("0x")) != 8:
+                    raise ValueError(f"Instruction {word} needs to be 32 bits long.")
+                if int(word, 16) & 0x7F not in KNOWN_OPCODES:
+                    assembly.append("unknown")
+                    continue
+                instr = parseHex_RV32I(word, upperCase=request.get("upperCase", False))
+                assembly.append(str(instr) if instr is not None else "unknown")
+            return {"ok" : True, "assembly" : assembly}
+        case "ping":
+            return {"ok" : True}
+        case op:
+            raise ValueError(f"Unknown request {op}.")
+
+
+def __read_lines(path):
+    if path == "-":
+        return sys.stdin.read().splitlines()
+    with open(path, 'r') as file:
+        return file.read().splitlines()
+
+
+def __read_hex(path):
+    words = []
+    for line in __read_lines(path):
+        line = line.split(';', 1)[0].strip()
+        if line:
+            words.append(line)
+    return words
+
+
+def __write_lines(path, lines):
+    text = "".join(f"{line}\n" for line in lines)
+    if path is None or path == "-":
+        sys.stdout.write(text)
+    else:
+        with open(path, 'w') as file:
+            file.write(text)
+
+
+def __run(args, request):
+    response = None
+    if not args.no_daemon:
+        response = daemonRequest(args.socket, request)
+    if response is None:
+        try:
+            response = handleRequest(request)
+        except Exception as e:
+            response = {"ok" : False, "error" : f"{type(e).__name__}: {e}"}
+
+    if not response["ok"]:
+        sys.stderr.write(f"rv32i: {response['error']}\n")
+        sys.exit(1)
+    return response
+
+
+def __assemble(args):
+    response = __run(args, {"op" : "assemble",
+                            "lines" : __read_lines(args.file),
+                            "optimize" : args.optimize,
+                            "scratchReg" : args.scratch})
+    __write_lines(args.output, response["hex"])
+
+
+def __disassemble(args):
+    response = __run(args, {"op" : "disassemble",
+                            "hex" : __read_hex(args.file),
+                            "upperCase" : args.upper})
+    __write_lines(args.output, response["assembly"])
+
+
+def __simulate(args):
+    from rv32i.RV32I_Sim import simulate_RV32I
+
+    if args.hex:
+        program = __read_hex(args.file)
+    else:
+        from rv32i.RV32I_Assembler import assemble_RV32I
+        program = assemble_RV32I(__read_lines(args.file), optimize=args.optimize, scratchReg=args.scratch)
+
+    cpu = simulate_RV32I(program, maxCycles=args.max_cycles)
+    sys.stdout.write(f"Halted: {cpu.halted} at pc 0x{cpu.pc:08x} after {cpu.cycles} cycles\n")
+    for i, val in enumerate(cpu.regs):
+        if val or args.all:
+            sys.stdout.write(f"Register: x{i:<3}= 0x{val:08x}  {val}\n")
+
+
+def __daemon(args):
+    from rv32i.RV32I_Daemon import serve
+
+    try:
+        serve(args.socket)
+    except RuntimeError as e:
+        sys.stderr.write(f"rv32i: {e}\n")
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="rv32i", description="RV32I assembler, disassembler and simulator")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def addDaemonOptions(command):
+        command.add_argument("--socket", default=defaultSocketPath(), help="daemon socket path")
+        command.add_argument("--no-daemon", action="store_true", help="always work in this process")
+
+    command = commands.add_parser("assemble", help="assemble source into a hex image")
+    command.add_argument("file", help="assembly source, - for stdin")
+    command.add_argument("-o", "--output", help="output file, stdout by default")
+    command.add_argument("-O", "--optimize", action="store_true", help="drop instructions with no effect")
+    command.add_argument("--scratch", type=int, default=6, help="register far jumps may clobber, x6 by default")
+    addDaemonOptions(command)
+    command.set_defaults(func=__assemble)
+
+    command = commands.add_parser("disassemble", help="disassemble a hex image")
+    command.add_argument("file", help="hex image, one word per line, - for stdin")
+    command.add_argument("-o", "--output", help="output file, stdout by default")
+    command.add_argument("--upper", action="store_true", help="upper case mnemonics")
+    addDaemonOptions(command)
+    command.set_defaults(func=__disassemble)
+
+    command = commands.add_parser("simulate", help="run a program on the single cycle CPU")
+    command.add_argument("file", help="assembly source, or a hex image with --hex")
+    command.add_argument("--hex", action="store_true", help="input is a hex image")
+    command.add_argument("-O", "--optimize", action="store_true", help="drop instructions with no effect")
+    command.add_argument("--scratch", type=int, default=6, help="register far jumps may clobber, x6 by default")
+    command.add_argument("--max-cycles", type=int, default=1000000, help="stop after this many cycles")
+    command.add_argument("--all", action="store_true", help="print every register, not just non-zero ones")
+    command.set_defaults(func=__simulate)
+
+    command = commands.add_parser("daemon", help="serve assemble/disassemble requests on a Unix socket")
+    command.add_argument("--socket", default=defaultSocketPath(), help="socket path")
+    command.set_defaults(func=__daemon)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
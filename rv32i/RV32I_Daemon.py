@@ -0,0 +1,96 @@
+"""
+    Resident assembler for build systems that call rv32i many times.
+
+    Serves assemble/disassemble requests on a Unix domain socket so a
+    short job costs a socket round trip instead of starting Python and
+    importing the instruction tables. One JSON object per line each
+    way:
+
+        {"op": "assemble", "lines": [...], "upperCase": false, "optimize": false, "scratchReg": 6}
+        {"ok": true, "hex": ["00000013", ...]}
+
+        {"op": "disassemble", "hex": ["00000013", ...], "upperCase": false}
+        {"ok": true, "assembly": ["addi x0,x0,0", ...]}
+
+    Failures come back as {"ok": false, "error": "..."}.
+
+    The socket is created owner only, and clients refuse a socket that
+    belongs to another user.
+
+"""
+import asyncio
+import json
+import os
+import signal
+
+# Imported up front so the first request does not pay for it
+import rv32i.RV32I_Instr
+import rv32i.RV32I_Assembler
+from rv32i.RV32I_CLI import defaultSocketPath, daemonRequest, handleRequest
+
+# Largest request line, a whole program arrives as one line
+MAX_REQUEST = 256 * 1024 * 1024
+
+
+async def __serve_client(reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except (ValueError, ConnectionError) as e:
+                # Over MAX_REQUEST or cut off, the stream can not be resynced
+                response = {"ok" : False, "error" : f"Could not read request: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+                break
+            if not line:
+                break
+
+            try:
+                # Keep the event loop free for other clients while a big job runs
+                response = await loop.run_in_executor(None, handleRequest, json.loads(line))
+            except Exception as e:
+                response = {"ok" : False, "error" : f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass                    # Client went away mid reply
+    finally:
+        writer.close()
+
+
+async def __serve(path):
+    # Clear a socket left by a daemon that did not shut down cleanly
+    if os.path.lexists(path):
+        if os.lstat(path).st_uid != os.getuid():
+            raise RuntimeError(f"{path} belongs to another user.")
+        if daemonRequest(path, {"op" : "ping"}) is not None:
+            raise RuntimeError(f"A daemon is already serving {path}.")
+        os.unlink(path)
+
+    # Bind under a tight umask so the socket is never open to others
+    umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(__serve_client, path=path, limit=MAX_REQUEST)
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def serve(path=None):
+    """Run the daemon in the foreground until interrupted"""
+    asyncio.run(__serve(path or defaultSocketPath()))
+
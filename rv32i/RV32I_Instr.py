@@ -11,8 +11,20 @@
 """
 import re
 
+from rv32i.RV32I_Profile import instrumented, inputSize, outputSize, wordSize
+
 COMMANDSPACING = 0
 
+# Signed immediate of the I format
+I_IMM_MIN = -(1 << 11)
+I_IMM_MAX = (1 << 11) - 1
+
+# Reachable PC-relative offsets of the B and J formats
+B_IMM_MIN = -(1 << 12)
+B_IMM_MAX = (1 << 12) - 2
+J_IMM_MIN = -(1 << 20)
+J_IMM_MAX = (1 << 20) - 2
+
 class instruction:
     def __init__(self, opcode, upperCase):
         self.opcode = opcode
@@ -27,6 +39,7 @@ class instruction:
         else:
             print("Invalid Endian: valid inputs \"big\" and \"little\"")
         
+    @instrumented("gethex", outputSize)
     def gethex(self, endian="big"):
         if endian == "big":
             return "{:08x}".format(int(self.instr, 2))[-8:]
@@ -54,6 +67,7 @@ class R_type(instruction):
         self.rd = "{:05b}".format(rd)[-5:]
         self.instr = self.funct7 + self.rs2 + self.rs1 + self.funct3 + self.rd + self.opcode
 
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -70,6 +84,7 @@ class R_type_shift(R_type):
     def __init__(self, funct7, rs2, rs1, funct3, rd, opcode, instrName, upperCase=False):
         R_type.__init__(self, funct7, rs2, rs1, funct3, rd, opcode, instrName, upperCase=upperCase)
 
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -95,6 +110,7 @@ class I_type (instruction):
         
         self.signed = signed
 
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -114,6 +130,7 @@ class I_type_load (I_type):
     def __init__(self, rs1, funct3, rd, imm, opcode, instrName, signed=False, upperCase=False):
         I_type.__init__(self, rs1, funct3, rd, imm, opcode, instrName, signed=signed, upperCase=upperCase)
     
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -142,6 +159,7 @@ class S_type (instruction):
         
         self.signed = signed
 
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -167,6 +185,7 @@ class B_type (instruction):
         self.funct3 = funct3
         self.instr = self.imm[0] + self.imm[2:8] + self.rs2 + self.rs1 + self.funct3 + self.imm[8:12] + self.imm[1] + self.opcode
     
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -187,6 +206,7 @@ class U_type (instruction):
         self.imm = "{:032b}".format(imm)[:20]
         self.instr = self.imm + self.rd + self.opcode
 
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -209,6 +229,7 @@ class J_type (instruction):
         imm = imm[0] + imm[10:20] + imm[9] + imm[1:9]
         self.instr = imm + self.rd + self.opcode
     
+    @instrumented("getAssembly", outputSize)
     def getAssembly(self):
         if (self.upperCase):
             instrName = self.instrName.upper()
@@ -216,7 +237,7 @@ class J_type (instruction):
             instrName = self.instrName.lower()
 
         rd = "x" + str(int(self.rd, 2))
-        imm = str(int(self.imm, 2))
+        imm = str(twos_comp(int(self.imm, 2), 21))
 
         return f"{instrName:<{COMMANDSPACING}}" + " " + rd + "," + imm
 
@@ -402,6 +423,7 @@ def parseBin_RV32I(instr):
     return __parse_RV32I_bin(instr)
 
 
+@instrumented("parse_bin", wordSize)
 def __parse_RV32I_bin(instr, upperCase=False):
     opcode = instr[25:32]
     rd = int(instr[20:25], 2)
@@ -544,6 +566,7 @@ def parseAssembly_RV32I(instr):
 
 
 # Does not handle register aliases right now 
+@instrumented("parse_assembly", inputSize)
 def __parse_RV32I_assembly_raw(instr):
     instr = re.sub(r'[\(\)\n]+', ' ', instr)
     instr = re.split(r'[,\s]+', instr)          # Split up mnemonic and registers
@@ -576,6 +599,9 @@ def __parse_RV32I_assembly_raw(instr):
                  "rs1" : int(instr[3][1:])}           
 
     def parse_B_type(instr):
+        if not (B_IMM_MIN <= int(instr[3]) <= B_IMM_MAX):
+            raise ValueError(f"Branch offset {instr[3]} is out of range for 13 bits.")
+
         if (int(instr[3]) < 0):
             instr[3] = int(decimal_to_twos_complement(int(instr[3]), 13), 2)
         else:
@@ -586,8 +612,16 @@ def __parse_RV32I_assembly_raw(instr):
                  "imm" : int(instr[3])}    
 
     def parse_J_type(instr):
+        if not (J_IMM_MIN <= int(instr[2]) <= J_IMM_MAX):
+            raise ValueError(f"Jump offset {instr[2]} is out of range for 21 bits.")
+
+        if (int(instr[2]) < 0):
+            instr[2] = int(decimal_to_twos_complement(int(instr[2]), 21), 2)
+        else:
+            instr[2] = int(instr[2])
+
         return { "rd" : int(instr[1][1:]), 
-                "imm" : int(instr[2])}  
+                "imm" : instr[2]}  
 
     def parse_U_type(instr):
         return { "rd" : int(instr[1][1:]), 
@@ -713,6 +747,49 @@ def __parse_RV32I_assembly_raw(instr):
             return ADDI(int(instr[2][1:]), int(instr[1][1:]),  0)    
         case "CLR":     
             return ADDI(0, int(instr[1][1:]), 0)
+        case "LI":
+            expansion = expandLI_RV32I(int(instr[1][1:]), int(instr[2], 0))
+            if len(expansion) != 1:
+                raise ValueError(f"LI {instr[2]} needs LUI+ADDI, use assemble_RV32I.")
+            return expansion[0]
+        case "J":
+            operands = parse_J_type([instr[0], "x0", instr[1]])
+            return JAL(0, operands["imm"])
+        case "CALL":
+            operands = parse_J_type([instr[0], "x1", instr[1]])
+            return JAL(1, operands["imm"])
+        case "RET":
+            return JALR(1, 0, 0)
+        case "BEQZ":
+            operands = parse_B_type([instr[0], instr[1], "x0", instr[2]])
+            return BEQ(operands["rs2"], operands["rs1"], operands["imm"])
+        case "BNEZ":
+            operands = parse_B_type([instr[0], instr[1], "x0", instr[2]])
+            return BNE(operands["rs2"], operands["rs1"], operands["imm"])
+        case "NOT":
+            return XORI(int(instr[2][1:]), int(instr[1][1:]), 0xFFF)
+        case "NEG":
+            return SUB(int(instr[2][1:]), 0, int(instr[1][1:]))
+        case "SEQZ":
+            return SLTIU(int(instr[2][1:]), int(instr[1][1:]), 1)
+
+
+def expandLI_RV32I(rd, imm):
+    """Shortest sequence loading a 32 bit constant into rd"""
+    if not (-(1 << 31) <= imm < (1 << 32)):
+        raise ValueError(f"Input number {imm} does not fit in 32 bits.")
+
+    # 0xFFFFFFFF is -1 to the register, keep the single ADDI forms
+    imm = twos_comp(imm & 0xFFFFFFFF, 32)
+    if I_IMM_MIN <= imm <= I_IMM_MAX:
+        return [ADDI(0, rd, imm & 0xFFF)]
+
+    # ADDI sign extends, so a negative low part borrows from the upper 20 bits
+    lo = ((imm & 0xFFF) ^ 0x800) - 0x800
+    hi = (imm - lo) & 0xFFFFFFFF
+    if lo == 0:
+        return [LUI(rd, hi)]
+    return [LUI(rd, hi), ADDI(rd, rd, lo & 0xFFF)]
 
 
 def decimal_to_twos_complement(number, num_bits):
@@ -0,0 +1,121 @@
+"""
+    Opt in timing counters for the assembler and disassembler stages.
+
+    Set RV32I_PROFILE before the first import of rv32i.RV32I_Instr:
+
+        RV32I_PROFILE=1 rv32i assemble big.rv32i        ; report on stderr
+        RV32I_PROFILE=prof.json rv32i assemble big.rv32i
+
+    Each stage collects its call count, time spent (perf_counter_ns)
+    and bytes handled. The report is written as JSON at exit, and
+    whenever the process gets SIGUSR1, which is handy for the daemon.
+
+    When RV32I_PROFILE is unset the decorators hand back the original
+    function, so there is nothing left to cost anything.
+
+    Stages nest: parse_program is assemble_RV32I's tokenizer and its
+    time includes the parse_assembly calls it makes for plain lines.
+    Branch, JAL, LI and LA lines are only counted in parse_program.
+
+"""
+import os
+import sys
+from time import perf_counter_ns
+
+PROFILE = os.environ.get("RV32I_PROFILE", "")
+ENABLED = PROFILE not in ("", "0")
+
+if ENABLED:
+    import atexit
+    import functools
+    import signal
+    import threading
+
+    # The daemon runs requests on executor threads. Reentrant, as the
+    # SIGUSR1 handler can run on a thread already holding it in timed().
+    __lock = threading.RLock()
+
+__counters = {}                 # Stage -> [calls, ns, bytes]
+
+
+def instrumented(stage, measure=None):
+    """Count calls to a function under stage. measure(args, result)
+    gives the number of bytes the call handled."""
+    if not ENABLED:
+        return lambda func: func
+
+    def wrap(func):
+        counter = __counters.setdefault(stage, [0, 0, 0])
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            result = func(*args, **kwargs)
+            elapsed = perf_counter_ns() - start
+            size = measure(args, result) if measure is not None else 0
+            with __lock:
+                counter[0] += 1
+                counter[1] += elapsed
+                counter[2] += size
+            return result
+        return timed
+    return wrap
+
+
+# Byte counts for instrumented()
+def inputSize(args, result):
+    return len(args[0])
+
+def linesSize(args, result):
+    return sum(len(line) for line in args[0])
+
+def outputSize(args, result):
+    return len(result) if result is not None else 0
+
+def wordSize(args, result):
+    return 4
+
+
+def report():
+    """Counters so far as a dict"""
+    stages = {}
+    if ENABLED:
+        with __lock:
+            counters = {stage: list(counter) for stage, counter in __counters.items()}
+    else:
+        counters = {}
+    for stage, (calls, ns, size) in counters.items():
+        stages[stage] = {"calls" : calls,
+                         "ns" : ns,
+                         "bytes" : size,
+                         "ns_per_call" : ns // calls if calls else 0}
+    return stages
+
+
+def resetCounters():
+    if not ENABLED:
+        return
+    with __lock:
+        for counter in __counters.values():
+            counter[:] = [0, 0, 0]
+
+
+def dumpReport(path=None):
+    """Write the report as JSON to path, or where RV32I_PROFILE says"""
+    import json
+
+    path = path or PROFILE
+    text = json.dumps(report(), indent=4) + "\n"
+    if path in ("1", "stderr"):
+        sys.stderr.write(text)
+    else:
+        with open(path, 'w') as file:
+            file.write(text)
+
+
+if ENABLED:
+    atexit.register(dumpReport)
+    try:
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dumpReport())
+    except (AttributeError, ValueError):
+        pass                    # No SIGUSR1 on this platform, or not the main thread
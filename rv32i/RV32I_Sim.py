@@ -0,0 +1,142 @@
+"""
+    Instruction level simulator for the RV32I Single Cycle CPU.
+
+    Every instruction takes one cycle. Instructions are fetched from
+    a read only program image and loads/stores go to a separate,
+    sparse data memory, as on the CPU.
+
+    A run stops when the program jumps to itself (the "JAL x1, 0"
+    at the end of Test.rv32i), leaves the image, hits an instruction
+    it can not decode or runs out of cycles.
+
+"""
+from rv32i.RV32I_Words import sext, immI, immS, immB, immJ, toWords_RV32I
+
+HALT_SELF_LOOP = "self loop"
+HALT_OUT_OF_PROGRAM = "left program"
+HALT_ILLEGAL = "illegal instruction"
+HALT_MAX_CYCLES = "cycle limit"
+
+MASK32 = 0xFFFFFFFF
+
+
+class singleCycleCPU:
+    def __init__(self, words, base=0):
+        self.rom = list(words)
+        self.base = base
+        self.regs = [0] * 32
+        self.mem = {}               # Byte address -> byte
+        self.pc = base
+        self.cycles = 0
+        self.halted = None
+
+    def load(self, addr, size, signed):
+        val = 0
+        for i in range(size):
+            val |= self.mem.get((addr + i) & MASK32, 0) << (8 * i)
+        return sext(val, 8 * size) & MASK32 if signed else val
+
+    def store(self, addr, size, val):
+        for i in range(size):
+            self.mem[(addr + i) & MASK32] = (val >> (8 * i)) & 0xFF
+
+    def step(self):
+        index = (self.pc - self.base) >> 2
+        if self.pc & 0x3 or not (0 <= index < len(self.rom)):
+            self.halted = HALT_OUT_OF_PROGRAM
+            return False
+
+        w = self.rom[index]
+        regs = self.regs
+        opcode = w & 0x7F
+        rd = (w >> 7) & 0x1F
+        funct3 = (w >> 12) & 0x7
+        a = regs[(w >> 15) & 0x1F]
+        b = regs[(w >> 20) & 0x1F]
+        imm = immI(w)
+        nextPc = (self.pc + 4) & MASK32
+        result = None
+
+        if opcode == 0x37:          # LUI
+            result = w & 0xFFFFF000
+        elif opcode == 0x17:        # AUIPC
+            result = (self.pc + (w & 0xFFFFF000)) & MASK32
+        elif opcode == 0x6F:        # JAL
+            result = nextPc
+            nextPc = (self.pc + immJ(w)) & MASK32
+        elif opcode == 0x67 and funct3 == 0:        # JALR
+            result = nextPc
+            nextPc = (a + imm) & MASK32 & ~1
+        elif opcode == 0x63:        # Branches
+            sa, sb = sext(a, 32), sext(b, 32)
+            match funct3:
+                case 0: taken = a == b
+                case 1: taken = a != b
+                case 4: taken = sa < sb
+                case 5: taken = sa >= sb
+                case 6: taken = a < b
+                case 7: taken = a >= b
+                case _:
+                    self.halted = HALT_ILLEGAL
+                    return False
+            if taken:
+                nextPc = (self.pc + immB(w)) & MASK32
+        elif opcode == 0x03:        # Loads
+            addr = (a + imm) & MASK32
+            match funct3:
+                case 0: result = self.load(addr, 1, True)
+                case 1: result = self.load(addr, 2, True)
+                case 2: result = self.load(addr, 4, False)
+                case 4: result = self.load(addr, 1, False)
+                case 5: result = self.load(addr, 2, False)
+                case _:
+                    self.halted = HALT_ILLEGAL
+                    return False
+        elif opcode == 0x23 and funct3 <= 2:        # Stores
+            self.store((a + immS(w)) & MASK32, 1 << funct3, b)
+        elif opcode == 0x13 or opcode == 0x33:      # ALU
+            if opcode == 0x13:
+                b = imm & MASK32
+                shamt = (w >> 20) & 0x1F
+                alt = funct3 == 5 and (w >> 30) & 1
+            else:
+                shamt = b & 0x1F
+                alt = (w >> 30) & 1
+            match funct3:
+                case 0: result = (a - b if alt and opcode == 0x33 else a + b) & MASK32
+                case 1: result = (a << shamt) & MASK32
+                case 2: result = int(sext(a, 32) < sext(b, 32))
+                case 3: result = int(a < b)
+                case 4: result = a ^ b
+                case 5: result = (sext(a, 32) >> shamt) & MASK32 if alt else a >> shamt
+                case 6: result = a | b
+                case 7: result = a & b
+        else:
+            self.halted = HALT_ILLEGAL
+            return False
+
+        if result is not None and rd != 0:
+            regs[rd] = result
+        self.cycles += 1
+
+        if nextPc == self.pc:
+            self.halted = HALT_SELF_LOOP
+            return False
+        self.pc = nextPc
+        return True
+
+    def run(self, maxCycles=1000000):
+        """Run until the program halts, returns why it stopped"""
+        while self.cycles < maxCycles:
+            if not self.step():
+                return self.halted
+        self.halted = HALT_MAX_CYCLES
+        return self.halted
+
+
+def simulate_RV32I(program, base=0, maxCycles=1000000):
+    """Run a program given as instruction objects, hex strings or
+    integer words. Returns the CPU after it halts."""
+    cpu = singleCycleCPU(toWords_RV32I(program), base)
+    cpu.run(maxCycles)
+    return cpu
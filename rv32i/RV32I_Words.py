@@ -0,0 +1,39 @@
+"""
+    Helpers for raw 32 bit instruction words, shared by the CFG
+    builder and the simulator so both read a program the same way.
+
+"""
+
+
+def sext(val, bits):
+    """Sign extend the low bits of val"""
+    return val - ((val & (1 << (bits - 1))) << 1)
+
+
+def immI(w):
+    return sext(w >> 20, 12)
+
+def immS(w):
+    return sext(((w >> 25) << 5) | ((w >> 7) & 0x1F), 12)
+
+def immB(w):
+    return sext(((w >> 31) << 12) | (((w >> 7) & 0x1) << 11) | (((w >> 25) & 0x3F) << 5) | (((w >> 8) & 0xF) << 1), 13)
+
+def immJ(w):
+    return sext(((w >> 31) << 20) | (((w >> 12) & 0xFF) << 12) | (((w >> 20) & 0x1) << 11) | (((w >> 21) & 0x3FF) << 1), 21)
+
+
+def toWords_RV32I(program):
+    """Integer words of a program given as instruction objects (from
+    parseHex_RV32I or assemble_RV32I), hex strings or integers"""
+    words = []
+    for instr in program:
+        if isinstance(instr, int):
+            words.append(instr)
+        elif isinstance(instr, str):
+            words.append(int(instr, 16))
+        elif instr is None:
+            words.append(0)         # Undecodable, 0 is not a valid instruction either
+        else:
+            words.append(int(instr.instr, 2))
+    return words
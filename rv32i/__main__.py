@@ -0,0 +1,3 @@
+from rv32i.RV32I_CLI import main
+
+main()
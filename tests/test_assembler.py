@@ -0,0 +1,176 @@
+"""
+    Program assembler checks: relaxation at the edges of each form's
+    reach, LI/LA expansion and the peephole pass. Programs are run on
+    the simulator so a wrong offset shows up as a wrong register.
+
+"""
+import os
+
+import pytest
+
+from rv32i.RV32I_Assembler import assemble_RV32I
+from rv32i.RV32I_Sim import simulate_RV32I, HALT_SELF_LOOP, HALT_OUT_OF_PROGRAM
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+HALT = "JAL x0, 0"
+
+
+def run(lines, **kwargs):
+    program = assemble_RV32I(lines, **kwargs)
+    return program, simulate_RV32I(program)
+
+
+def forward(jump, fill):
+    """jump over fill NOPs to a label that sets x5"""
+    return [f"{jump} end"] + ["NOP"] * fill + ["end: ADDI x5, x0, 1", HALT]
+
+
+def backward(jump, fill):
+    """jump back over fill NOPs (plus the two lines at back) to a
+    label that sets x5"""
+    return (["J start", "back: ADDI x5, x0, 1", HALT] + ["NOP"] * fill +
+            [f"start: {jump} back"])
+
+
+# (jump, NOPs between it and its target, words it takes)
+FORWARD_CASES = [("BEQ x0, x0,", 1022, 1),      # +4092, the most a branch reaches
+                 ("BEQ x0, x0,", 1023, 2),      # +4096 needs the JAL form
+                 ("BNEZ x1,", 1023, 2),         # Falls through, still relaxed
+                 ("J", 1023, 1)]
+
+BACKWARD_CASES = [("BEQ x0, x0,", 1022, 1),     # -4096
+                  ("BEQ x0, x0,", 1023, 2),     # -4100
+                  ("BLTU x1, x2,", 1023, 2),
+                  ("J", 1023, 1)]
+
+
+@pytest.mark.parametrize("jump, fill, words", FORWARD_CASES)
+def test_relax_forward(jump, fill, words):
+    program, cpu = run(forward(jump, fill))
+    assert len(program) == fill + 2 + words
+    assert cpu.halted == HALT_SELF_LOOP
+    assert cpu.regs[5] == 1
+
+
+@pytest.mark.parametrize("jump, fill, words", BACKWARD_CASES)
+def test_relax_backward(jump, fill, words):
+    lines = backward(jump, fill)
+    if jump.startswith("BLTU"):
+        lines.insert(0, "ADDI x1, x0, 1")       # Taken when x2 < x1
+    program, cpu = run(lines)
+    assert len(program) == len(lines) - 1 + words
+    assert cpu.halted == HALT_SELF_LOOP
+    assert cpu.regs[5] == 1
+
+
+def test_relax_far_forward():
+    # +1MiB is past the branch's JAL form and a plain J
+    for jump, fill, words in (("BEQ x0, x0,", 262142, 2),
+                              ("BEQ x0, x0,", 262143, 3),
+                              ("J", 262142, 1),
+                              ("J", 262143, 2),
+                              ("CALL", 262143, 2)):
+        program, cpu = run(forward(jump, fill))
+        assert len(program) == fill + 2 + words, jump
+        assert cpu.regs[5] == 1, jump
+
+
+def test_relax_far_backward():
+    # start is 1MiB after back, the JAL form just stops reaching it.
+    # J start at the top is past 1MiB as well and takes two words.
+    for jump, fill, words in (("BNE x0, x1,", 262141, 2),
+                              ("BNE x0, x1,", 262142, 3),
+                              ("J", 262142, 1),
+                              ("J", 262143, 2)):
+        lines = backward(jump, fill)
+        lines.insert(0, "ADDI x1, x0, 1")
+        program, cpu = run(lines)
+        assert len(program) == len(lines) + words, jump
+        assert cpu.regs[5] == 1, jump
+
+
+def test_relax_fixed_address():
+    # Numeric offsets off the end of the program are absolute addresses
+    for offset in (4092, 4096, 1048572, 1048576, 0x7FFFF0):
+        program, cpu = run([f"BEQ x0, x0, {offset}"])
+        assert cpu.halted == HALT_OUT_OF_PROGRAM
+        assert cpu.pc == offset
+
+
+def test_relax_cascade():
+    # Each branch just reaches past the next one until the last grows
+    lines = ["NOP"] * 12000
+    for i in range(0, 10000, 1000):
+        lines[i] = "BEQ x1, x2, 4092"
+    lines[9000] = "BEQ x1, x2, 4096"
+    program = assemble_RV32I(lines)
+    assert len(program) == 12000 + 10
+
+
+def test_relax_shared_label():
+    lines = ["BNE x1, x0, exit"] * 3000 + ["ADDI x5, x0, 2", HALT, "exit: ADDI x5, x0, 1", HALT]
+    program, cpu = run(lines)
+    # Only the branches within 4KiB of exit, the last 1021, stay short
+    assert len(program) == 3000 + 4 + 1979
+    assert cpu.regs[5] == 2
+
+    program, cpu = run(["ADDI x1, x0, 1"] + lines)
+    assert cpu.regs[5] == 1
+
+
+LI_VALUES = [0, 1, -1, 2047, -2048, 2048, -2049, 0x800, 0xFFF, 0x1000,
+             0x7FFFF000, 0x7FFFF7FF, 0x7FFFF800, 0x7FFFFFFF, -0x80000000,
+             0x80000800, 0x12345678, 0xABCDE800, 0xFFFFF800, 0xFFFFFFFF]
+
+
+@pytest.mark.parametrize("value", LI_VALUES)
+def test_li_round_trip(value):
+    program, cpu = run([f"LI x5, {value}", HALT])
+    assert cpu.regs[5] == value & 0xFFFFFFFF
+
+    signed = ((value & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
+    if -2048 <= signed < 2048 or signed & 0xFFF == 0:
+        assert len(program) == 2
+    else:
+        assert len(program) == 3
+
+
+def test_la():
+    program, cpu = run(["LA x5, data", "LA x6, 0x12345", HALT, "NOP", "data: NOP"])
+    assert cpu.regs[5] == 4 * (len(program) - 1)
+    assert cpu.regs[6] == 0x12345
+
+
+def test_optimize_test_program():
+    with open(os.path.join(ROOT, "Test.rv32i"), 'r') as file:
+        lines = file.read().splitlines()
+
+    plain, cpu = run(lines)
+    small, fast = run(lines, optimize=True)
+    assert len(small) < len(plain)
+    assert not any(instr.gethex() == "00000013" for instr in small)
+    assert cpu.halted == fast.halted == HALT_SELF_LOOP
+    assert fast.cycles < cpu.cycles
+    assert cpu.regs[10] == fast.regs[10] == 8 * 16
+    assert cpu.regs[11] == fast.regs[11] == 16
+
+
+def test_optimize_label_moves_on():
+    program, cpu = run(["ADDI x5, x0, 3", "J skip", "ADDI x5, x0, 9",
+                        "skip: MV x5, x5", "ADDI x5, x5, 1", HALT], optimize=True)
+    assert len(program) == 5
+    assert cpu.regs[5] == 4
+
+
+def test_scratch_register():
+    far = forward("J", 262143)
+    with pytest.raises(ValueError, match="x6"):
+        assemble_RV32I(["ADDI x6, x0, 1"] + far)
+
+    program, cpu = run(["ADDI x6, x0, 1"] + far, scratchReg=7)
+    assert cpu.regs[5] == 1
+    assert cpu.regs[6] == 1
+
+    # Near jumps leave the scratch register alone
+    run(["ADDI x6, x0, 1"] + forward("J", 10))
@@ -0,0 +1,74 @@
+"""
+    CFG checks against the simulator: the static bound has to cover the
+    cycles a run actually takes, including on relaxed far jumps.
+
+"""
+import os
+
+from rv32i.RV32I_Assembler import assemble_RV32I
+from rv32i.RV32I_CFG import buildCFG_RV32I, TERM_JALR
+from rv32i.RV32I_Sim import simulate_RV32I, HALT_SELF_LOOP
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+LOOP = ["ADDI x5, x0, 100", "loop: ADDI x5, x5, -1", "BNEZ x5, loop"]
+
+
+def bounded(program, count):
+    """The CFG with its one loop bounded to count iterations, and the bound"""
+    cfg = buildCFG_RV32I(program)
+    assert len(cfg.loops) == 1
+    header = cfg.blocks[cfg.loops[0].header].start
+    return cfg, cfg.worstCaseCycles({header : count})
+
+
+def test_test_program():
+    with open(os.path.join(ROOT, "Test.rv32i"), 'r') as file:
+        program = assemble_RV32I(file.read().splitlines())
+    cpu = simulate_RV32I(program)
+    cfg, cycles = bounded(program, 8)
+    assert cpu.halted == HALT_SELF_LOOP
+    assert cpu.cycles <= cycles
+    assert cfg.worstCaseCycles() is None
+
+
+def test_far_call():
+    # CALL past 1MiB becomes AUIPC/JALR, the callee still has to count
+    program = assemble_RV32I(["CALL func", "JAL x0, 0"] + ["NOP"] * 300000 +
+                             ["func:"] + LOOP + ["RET"])
+    assert len(program) == 300000 + 2 + 4 + 1
+    cpu = simulate_RV32I(program)
+    cfg, cycles = bounded(program, 100)
+    assert cfg.functions == [0, cfg.blockAt(4 * 300003).id]
+    assert cpu.cycles <= cycles
+    assert cfg.report()["reachable_instructions"] == 2 + 1 + 4
+
+
+def test_far_jump():
+    program = assemble_RV32I(["J start"] + ["NOP"] * 300000 +
+                             ["start:"] + LOOP + ["JAL x0, 0"])
+    cpu = simulate_RV32I(program)
+    cfg, cycles = bounded(program, 100)
+    assert cfg.functions == [0]
+    assert cpu.cycles <= cycles
+
+
+def test_jump_into_far_pair():
+    # Landing on the JALR skips the AUIPC, so its base is anyone's guess
+    program = assemble_RV32I(["BNE x1, x0, 8", "AUIPC x6, 0", "JALR x0, x6, 16",
+                              "NOP", "NOP", "JAL x0, 0"])
+    cfg = buildCFG_RV32I(program)
+    assert cfg.blockAt(8).terminator == TERM_JALR
+
+
+def test_shared_code():
+    # Every function runs into the same code, each still pays for all of it
+    lines = [f"CALL f{i}" for i in range(50)] + ["JAL x0, 0"]
+    for i in range(50):
+        lines += [f"f{i}: ADDI x5, x5, 1", "J shared"]
+    lines += ["shared: NOP"] + ["BNE x5, x0, 8", "ADDI x6, x6, 1"] * 50 + ["RET"]
+    program = assemble_RV32I(lines)
+    cpu = simulate_RV32I(program)
+    cfg = buildCFG_RV32I(program)
+    assert len(cfg.functions) == 51
+    assert cpu.cycles <= cfg.worstCaseCycles() <= cpu.cycles + 50 * 50
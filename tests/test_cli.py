@@ -0,0 +1,20 @@
+"""
+    Requests as the daemon and the local path answer them.
+
+"""
+from rv32i.RV32I_CLI import handleRequest
+
+
+def test_disassemble_unknown(capsys):
+    response = handleRequest({"op" : "disassemble", "hex" : ["00000013", "ffffffff", "12345678", "00a00513"]})
+    assert response["assembly"] == ["addi x0,x0,0", "unknown", "unknown", "addi x10,x0,10"]
+    # Only the assembly goes to stdout, one line per word
+    assert capsys.readouterr().out == ""
+
+
+def test_assemble_round_trip():
+    lines = ["ADDI x10, x0, 10", "loop: ADDI x10, x10, -1", "BNEZ x10, loop", "JAL x0, 0"]
+    words = handleRequest({"op" : "assemble", "lines" : lines})["hex"]
+    assembly = handleRequest({"op" : "disassemble", "hex" : words})["assembly"]
+    assert len(assembly) == len(words) == 4
+    assert assembly[0] == "addi x10,x0,10"
@@ -0,0 +1,41 @@
+"""
+    Profiling is switched on by the environment when the module is first
+    imported, so these run in a child interpreter.
+
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def profiled(code, path):
+    env = dict(os.environ, RV32I_PROFILE=str(path), PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, "-c", code], env=env, timeout=20,
+                          capture_output=True, text=True)
+
+
+def test_counts_stages(tmp_path):
+    path = tmp_path / "prof.json"
+    result = profiled("from rv32i.RV32I_Assembler import assemble_RV32I\n"
+                      "assemble_RV32I(['ADDI x5, x5, 1'] * 10 + ['BEQ x5, x0, 8'])\n", path)
+    assert result.returncode == 0, result.stderr
+
+    with open(path, 'r') as file:
+        stages = json.load(file)
+    assert stages["parse_assembly"]["calls"] == 10
+    assert stages["parse_program"]["calls"] == 1
+    assert stages["relax"]["calls"] == 1
+
+
+def test_sigusr1_while_counting(tmp_path):
+    # The handler runs on the main thread, which may be holding the lock
+    result = profiled("import signal\n"
+                      "import rv32i.RV32I_Profile as profile\n"
+                      "with getattr(profile, '__lock'):\n"
+                      "    signal.raise_signal(signal.SIGUSR1)\n"
+                      "print('ok')\n", tmp_path / "prof.json")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "ok\n"